@@ -1,7 +1,18 @@
 import streamlit as st
-import pandas as pd
+import diskcache
+import orjson
 import requests
-import base64
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- КОНФИГУРАЦИЯ СТРАНИЦЫ ---
 st.set_page_config(
@@ -12,141 +23,471 @@ st.set_page_config(
 
 # --- ЛОГИКА АГРЕГАТОРА (BACKEND) ---
 
+# Мусорные слова, не несущие смысла для поиска товара
+_STOP_WORDS = frozenset({'купить', 'цена', 'поиск', 'лучший', 'buy', 'price', 'cheap', 'best', 'find'})
+
+# Токенизация одним C-проходом: findall сам отбрасывает пробелы и пунктуацию
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Общая HTTP-сессия: keep-alive избавляет от TLS-рукопожатия на каждый запрос
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    # POST тоже в allowed_methods: запрос токена идемпотентен
+    max_retries=Retry(total=3, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET", "POST"])
+))
+
+
+# Локальный кеш токенов: (client_id, client_secret) -> (token, момент истечения)
+_TOKEN_CACHE = {}
+
+_EMPTY = {}
+
+
+class EbayAuthError(Exception):
+    """Сбой авторизации eBay: токен не выдан или отклонён (401)"""
+
+
+@functools.lru_cache(maxsize=8)
+def _basic_auth(client_id, client_secret):
+    """Заголовок Basic-авторизации: считается один раз на пару ключей"""
+    import base64  # нужен только здесь, и только раз на пару ключей
+    return "Basic " + base64.b64encode(f"{client_id}:{client_secret}".encode('ascii')).decode('ascii')
+
+
+def _shipping_value(opt, _get=dict.get):
+    """Сырая стоимость первой опции доставки (None, если опции нет)"""
+    if not isinstance(opt, dict):
+        return None
+    return _get(_get(opt, 'shippingCost', _EMPTY), 'value', None)
+
+
+# Дисковый снимок курсов валют: переживает перезапуск процесса Streamlit
+_RATES_CACHE_FILE = Path('.cache/rates.json')
+_RATES_MAX_AGE = 86400  # сутки
+
+
+def _save_rates_snapshot(rates):
+    """Атомарная запись курсов на диск (tmp-файл + rename)"""
+    try:
+        _RATES_CACHE_FILE.parent.mkdir(exist_ok=True)
+        tmp = _RATES_CACHE_FILE.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'rates': rates, 'fetched': time.time()}))
+        os.replace(tmp, _RATES_CACHE_FILE)
+    except Exception:
+        pass
+
+
+def _load_rates_snapshot(max_age=_RATES_MAX_AGE):
+    """Чтение дискового снимка курсов (max_age=None — без проверки возраста)"""
+    try:
+        if _RATES_CACHE_FILE.exists() and (
+                max_age is None or time.time() - _RATES_CACHE_FILE.stat().st_mtime < max_age):
+            return json.loads(_RATES_CACHE_FILE.read_text()).get('rates')
+    except Exception:
+        pass
+    return None
+
+
+@st.cache_data(ttl=7000)
+def _get_ebay_token_cached(client_id, client_secret):
+    """Получение токена eBay (Client Credentials).
+
+    Срок жизни берём из expires_in ответа (с запасом в минуту), а не из
+    фиксированного TTL — так токен не запрашивается раньше времени и не
+    используется протухшим.
+
+    Любой сбой (сеть, не-200, пустой ответ) поднимается исключением:
+    st.cache_data не запоминает упавшие вызовы, поэтому временная ошибка
+    не прилипает к кешу на весь TTL. None кешируется только для
+    детерминированного случая пустых ключей.
+    """
+    if not client_id or not client_secret:
+        return None
+
+    now = time.time()
+    cached = _TOKEN_CACHE.get((client_id, client_secret))
+    if cached and now < cached[1] - 60:
+        return cached[0]
+
+    headers = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "Authorization": _basic_auth(client_id, client_secret)
+    }
+    data = {
+        "grant_type": "client_credentials",
+        "scope": "https://api.ebay.com/oauth/api_scope"
+    }
+    response = _HTTP.post("https://api.ebay.com/identity/v1/oauth2/token", headers=headers, data=data, timeout=(3, 10))
+    if response.status_code != 200:
+        raise EbayAuthError(f"HTTP {response.status_code} при получении токена")
+    payload = orjson.loads(response.content)
+    token = payload.get('access_token')
+    if not token:
+        raise EbayAuthError("ответ токен-эндпоинта без access_token")
+    _TOKEN_CACHE[(client_id, client_secret)] = (token, now + payload.get('expires_in', 7200))
+    return token
+
+
+@st.cache_data(ttl=3600)
+def _get_exchange_rates_cached(api_key, base="USD"):
+    """Кеширование курсов валют (ключ кеша - строка API-ключа)"""
+    if not api_key:
+        return {}
+
+    # Свежий дисковый снимок избавляет от запроса при холодном старте
+    snapshot = _load_rates_snapshot()
+    if snapshot:
+        return snapshot
+
+    url = f"https://v6.exchangerate-api.com/v6/{api_key}/latest/{base}"
+    try:
+        response = _HTTP.get(url, timeout=(3, 5))
+        data = orjson.loads(response.content)
+        if data.get('result') == 'success':
+            rates = data['conversion_rates']
+            _save_rates_snapshot(rates)
+            return rates
+    except Exception:
+        pass
+
+    # API недоступен: старый снимок лучше, чем отсутствие конвертации
+    return _load_rates_snapshot(max_age=None) or {}
+
+
+# Готовые выражения фильтра состояний (IDs состояний товара)
+_COND_FILTERS = {
+    "New": 'conditionIds:{1000}',
+    "Used/Refurbished": 'conditionIds:{1500|2000|2500|3000}',
+    "Any": None,
+}
+
+# Схема результирующей таблицы: единый порядок колонок для всех путей
+_RESULT_COLUMNS = ('Source', 'Title', 'Condition', 'Price Info', 'Total (USD)', 'Image', 'URL')
+
+
+# Реестр запросов "в полёте": одинаковые одновременные поиски из разных
+# сессий совмещаются в один сетевой вызов (single-flight)
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def _single_flight(key, fn):
+    """Второй одновременный вызов с тем же ключом ждёт результат первого"""
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        if future is not None:
+            owner = False
+        else:
+            future = Future()
+            _INFLIGHT[key] = future
+            owner = True
+
+    if not owner:
+        return future.result()
+
+    try:
+        result = fn()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(key, None)
+
+
+def _inline_images(df):
+    """Параллельная закачка миниатюр и встраивание их как data:-URL.
+
+    Браузер тянет картинки ImageColumn по одной; если вшить их в таблицу,
+    они приходят вместе с ней и кешируются вместе с результатом поиска.
+    """
+    import base64
+
+    def fetch(url):
+        if not url or not url.startswith('http'):
+            return url
+        try:
+            resp = _HTTP.get(url, timeout=(3, 5))
+            if resp.status_code == 200:
+                mime = resp.headers.get('Content-Type', 'image/jpeg')
+                return f"data:{mime};base64," + base64.b64encode(resp.content).decode('ascii')
+        except Exception:
+            pass
+        return url
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        return df.assign(Image=list(pool.map(fetch, df['Image'].tolist())))
+
+
+# Листинги меняются медленно: 10 минут устаревания - приемлемая цена
+# за мгновенный ответ на повторный запрос и экономию квоты API
+_SEARCH_TTL = 600
+
+# Второй ярус кеша результатов: st.cache_data живёт в памяти процесса,
+# дисковый ярус переживает рестарты контейнера
+_DISK_CACHE = diskcache.Cache('.cache/search', size_limit=50_000_000)
+
+
+@st.cache_data(ttl=_SEARCH_TTL, show_spinner=False)
+def _cached_ebay_search(clean_query, condition, limit, keys_hash, _token, _scale):
+    """Сетевая часть поиска: повтор запроса в течение TTL отдаётся из кеша.
+
+    Ключ кеша - очищенный запрос, фильтр состояния, лимит и короткий хеш
+    пары ключей; токен и курсы (с подчёркиванием) в ключ не входят.
+
+    Сетевые сбои поднимаются исключениями (их показывает main): упавший
+    вызов не кешируется, и следующий клик честно повторит запрос.
+    """
+    import pandas as pd  # ленивый импорт: не тормозит первую отрисовку
+
+    cache_key = (clean_query, condition, limit, keys_hash)
+    cached = _DISK_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Формирование фильтров (IDs состояний товара); fieldgroups режет
+    # ответ до нужных полей - меньше байтов на передачу и разбор.
+    # Аукционы отсекаем сразу: для сравнения цен текущая ставка - не цена
+    params = {'q': clean_query, 'limit': 10, 'fieldgroups': 'MATCHING_ITEMS'}
+    filters = ['buyingOptions:{FIXED_PRICE}']
+    cond_filter = _COND_FILTERS.get(condition)
+    if cond_filter:
+        filters.append(cond_filter)
+    params['filter'] = ','.join(filters)
+
+    url = "https://api.ebay.com/buy/browse/v1/item_summary/search"
+    headers = {
+        "Authorization": f"Bearer {_token}",
+        "X-EBAY-C-MARKETPLACE-ID": "EBAY_US",
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate"
+    }
+
+    def fetch_page(offset):
+        response = _HTTP.get(url, params={**params, 'offset': offset}, headers=headers, timeout=(3, 10))
+        if response.status_code == 401:
+            raise EbayAuthError("токен не принят")
+        response.raise_for_status()
+        return orjson.loads(response.content).get('itemSummaries') or []
+
+    # Browse API отдаёт максимум 10 позиций за вызов: страницы
+    # запрашиваем параллельно, но не больше 10 потоков,
+    # чтобы не упереться в rate-limit eBay
+    offsets = range(0, limit, 10)
+    if len(offsets) == 1:
+        pages = [fetch_page(0)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(offsets), 10)) as pool:
+            pages = list(pool.map(fetch_page, offsets))
+
+    # Слияние страниц с дедупликацией по itemId
+    # (методы привязаны к локальным именам, чтобы не резолвить
+    # атрибуты на каждой итерации)
+    seen = set()
+    items = []
+    seen_add = seen.add
+    items_append = items.append
+    dg = dict.get
+    for page in pages:
+        for item in page:
+            item_id = dg(item, 'itemId')
+            if item_id not in seen:
+                seen_add(item_id)
+                items_append(item)
+
+    if not items:
+        return pd.DataFrame(columns=_RESULT_COLUMNS)
+
+    # Разбор ответа без Python-цикла: json_normalize раскрывает
+    # вложенные поля (price.value и т.д.) одним проходом
+    raw = pd.json_normalize(items, sep='.')
+    for col, default in (('title', ''), ('condition', 'Unknown'),
+                         ('price.value', 0), ('price.currency', 'USD'),
+                         ('image.imageUrl', ''), ('itemWebUrl', '#')):
+        if col not in raw.columns:
+            raw[col] = default
+
+    # Числа парсим одним C-проходом; мусорные значения становятся 0
+    raw_price = pd.to_numeric(raw['price.value'], errors='coerce').fillna(0.0)
+    currency = raw['price.currency'].fillna('USD')
+
+    # Доставка: первая опция, если она есть
+    if 'shippingOptions' in raw.columns:
+        shipping = pd.to_numeric(
+            raw['shippingOptions'].str[0].map(_shipping_value),
+            errors='coerce'
+        ).fillna(0.0)
+    else:
+        shipping = pd.Series(0.0, index=raw.index)
+
+    # Итоговая цена (Landed Cost) с конвертацией в USD одним
+    # векторным умножением вместо вызова функции на каждую строку
+    scale = currency.map(_scale).fillna(1.0) if _scale else 1.0
+    total_usd = (raw_price + shipping) * scale
+
+    result = pd.DataFrame({
+        "Source": "eBay",
+        "Title": raw['title'],
+        "Condition": raw['condition'].fillna('Unknown'),
+        "Price Info": (raw_price.astype(str) + " " + currency
+                       + " (+ " + shipping.astype(str) + " ship)"),
+        "Total (USD)": total_usd,
+        "Image": raw['image.imageUrl'].fillna(''),
+        "URL": raw['itemWebUrl'].fillna('#')
+    })
+    result = _inline_images(result)
+    try:
+        _DISK_CACHE.set(cache_key, result, expire=_SEARCH_TTL)
+    except Exception:
+        pass  # сбой записи на диск не должен терять уже разобранный результат
+    return result
+
+
 class EbayAggregator:
     def __init__(self, api_keys):
         self.keys = api_keys
         self.target_currency = "USD"
-        self.stop_words = {'купить', 'цена', 'поиск', 'лучший', 'buy', 'price', 'cheap', 'best', 'find'}
-        self.rates = self._get_exchange_rates()
-
-    @st.cache_data(ttl=3600)
-    def _get_exchange_rates(_self):
-        """Кеширование курсов валют"""
-        if not _self.keys.get('exchange_rate_key'):
-            return {}
-        
-        url = f"https://v6.exchangerate-api.com/v6/{_self.keys['exchange_rate_key']}/latest/{_self.target_currency}"
-        try:
-            response = requests.get(url, timeout=5)
-            data = response.json()
-            if data.get('result') == 'success':
-                return data['conversion_rates']
-        except Exception:
-            return {}
-        return {}
+        self.rates = {}
+        self._scale = None
+        # Агрегатор живёт в st.cache_resource, поэтому пул потоков можно
+        # держать постоянно и не пересоздавать на каждый поиск
+        self._pool = ThreadPoolExecutor(max_workers=4)
 
-    def _convert_price(self, price, currency):
-        """Конвертация цены в USD"""
-        if currency == self.target_currency:
-            return price
-        if not self.rates or currency not in self.rates:
-            return price 
-        rate = self.rates.get(currency, 1)
-        return price / rate
+    def _get_exchange_rates(self):
+        """Курсы валют из кеша (см. _get_exchange_rates_cached)"""
+        return _get_exchange_rates_cached(self.keys.get('exchange_rate_key', ''), self.target_currency)
 
     def _nlp_clean_query(self, query):
-        words = query.lower().split()
-        keywords = [w for w in words if w not in self.stop_words]
-        return " ".join(keywords)
+        return " ".join(w for w in _TOKEN_RE.findall(query.lower()) if w not in _STOP_WORDS)
 
     def _get_ebay_token(self):
-        """Получение токена eBay (Client Credentials)"""
+        """Токен eBay из кеша (см. _get_ebay_token_cached); None при сбое"""
         try:
-            if not self.keys['ebay_client_id'] or not self.keys['ebay_client_secret']:
-                return None
-            
-            auth_str = f"{self.keys['ebay_client_id']}:{self.keys['ebay_client_secret']}"
-            headers = {
-                "Content-Type": "application/x-www-form-urlencoded",
-                "Authorization": "Basic " + base64.b64encode(auth_str.encode()).decode()
-            }
-            data = {
-                "grant_type": "client_credentials",
-                "scope": "https://api.ebay.com/oauth/api_scope"
-            }
-            response = requests.post("https://api.ebay.com/identity/v1/oauth2/token", headers=headers, data=data, timeout=10)
-            response.raise_for_status()
-            return response.json().get('access_token')
+            return _get_ebay_token_cached(self.keys['ebay_client_id'], self.keys['ebay_client_secret'])
         except Exception as e:
             print(f"Auth Error: {e}")
             return None
 
-    def search_ebay(self, query, condition="New"):
+    def search_ebay(self, query, condition="New", limit=10):
         """Поиск по eBay API"""
+        import pandas as pd
+
         clean_query = self._nlp_clean_query(query)
-        token = self._get_ebay_token()
-        
+
+        # Токен eBay и курсы валют — независимые запросы, выполняем параллельно
+        token_future = self._pool.submit(self._get_ebay_token)
+        rates_future = self._pool.submit(self._get_exchange_rates)
+        token = token_future.result()
+        self.rates = rates_future.result()
+
+        # Обратные курсы считаем один раз: конвертация строки - одно умножение,
+        # а без ключа курсов (демо) горячий путь вообще не трогает словарь
+        self._scale = {cur: 1.0 / r for cur, r in self.rates.items() if r} if self.rates else None
+
         if not token:
-            return []
-
-        # Формирование фильтров (IDs состояний товара)
-        filter_str = ""
-        if condition == "New":
-            filter_str = "&filter=conditionIds:{1000}"
-        elif condition == "Used/Refurbished":
-            filter_str = "&filter=conditionIds:{1500|2000|2500|3000}"
-
-        url = f"https://api.ebay.com/buy/browse/v1/item_summary/search?q={clean_query}&limit=10{filter_str}"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "X-EBAY-C-MARKETPLACE-ID": "EBAY_US"
-        }
-        
-        try:
-            response = requests.get(url, headers=headers, timeout=10)
-            data = response.json()
-            results = []
-            
-            if 'itemSummaries' in data:
-                for item in data['itemSummaries']:
-                    # Цена и валюта
-                    price_obj = item.get('price', {})
-                    raw_price = float(price_obj.get('value', 0))
-                    currency = price_obj.get('currency', 'USD')
-                    
-                    # Доставка
-                    shipping = 0.0
-                    if 'shippingOptions' in item and len(item['shippingOptions']) > 0:
-                        ship_opt = item['shippingOptions'][0]
-                        ship_cost = ship_opt.get('shippingCost', {})
-                        shipping = float(ship_cost.get('value', 0))
-
-                    # Итоговая цена (Landed Cost)
-                    final_price = self._convert_price(raw_price + shipping, currency)
-                    
-                    cond_text = item.get('condition', "Unknown")
-                    image_url = item.get('image', {}).get('imageUrl', '')
-
-                    results.append({
-                        "Source": "eBay",
-                        "Title": item.get('title'),
-                        "Condition": cond_text,
-                        "Price Info": f"{raw_price} {currency} (+ {shipping} ship)",
-                        "Total (USD)": final_price,
-                        "Image": image_url,
-                        "URL": item.get('itemWebUrl')
-                    })
-            return results
-        except Exception as e:
-            st.error(f"Ошибка соединения с eBay: {e}")
-            return []
-
-    def get_mock_data(self, condition_filter):
-        """Демонстрационные данные (если нет ключей)"""
-        mock_db = [
-            {"Source": "eBay", "Title": "Apple iPhone 15 Pro 128GB (New)", "Condition": "New", "Price Info": "999.00 USD (+ 0 ship)", "Total (USD)": 999.00, "Image": "https://i.ebayimg.com/images/g/test/s-l500.jpg", "URL": "#"},
-            {"Source": "eBay", "Title": "Apple iPhone 15 Pro (Open Box)", "Condition": "Open Box", "Price Info": "850.00 USD (+ 15 ship)", "Total (USD)": 865.00, "Image": "https://i.ebayimg.com/images/g/test2/s-l500.jpg", "URL": "#"},
-            {"Source": "eBay", "Title": "iPhone 15 Pro Parts Only", "Condition": "Parts", "Price Info": "200.00 USD (+ 10 ship)", "Total (USD)": 210.00, "Image": "https://i.ebayimg.com/images/g/test3/s-l500.jpg", "URL": "#"},
-        ]
-        
-        if condition_filter == "New":
-            return [x for x in mock_db if "New" in x['Condition']]
-        elif condition_filter == "Used/Refurbished":
-            return [x for x in mock_db if "New" not in x['Condition']]
-        return mock_db
+            return pd.DataFrame(columns=_RESULT_COLUMNS)
+
+        # В кеш-ключ идёт короткий хеш пары ключей, а не сами креденшалы
+        keys_hash = hashlib.sha1(
+            f"{self.keys['ebay_client_id']}:{self.keys['ebay_client_secret']}".encode()
+        ).hexdigest()[:12]
+
+        flight_key = (clean_query, condition, limit, keys_hash)
+        for attempt in range(2):
+            try:
+                tok = token
+                return _single_flight(
+                    flight_key,
+                    lambda: _cached_ebay_search(clean_query, condition, limit, keys_hash,
+                                                _token=tok, _scale=self._scale)
+                )
+            except EbayAuthError:
+                # Протухший токен: сбрасываем оба слоя кеша и повторяем один раз
+                _TOKEN_CACHE.pop((self.keys['ebay_client_id'], self.keys['ebay_client_secret']), None)
+                _get_ebay_token_cached.clear()
+                token = self._get_ebay_token()
+                if not token:
+                    break
+
+        st.error("eBay не принял ключи API. Проверьте Client ID / Secret.")
+        return pd.DataFrame(columns=_RESULT_COLUMNS)
+
+
+@st.cache_data
+def get_mock_data(condition_filter):
+    """Демонстрационные данные (если нет ключей)"""
+    import pandas as pd
+
+    mock_db = pd.DataFrame([
+        {"Source": "eBay", "Title": "Apple iPhone 15 Pro 128GB (New)", "Condition": "New", "Price Info": "999.00 USD (+ 0 ship)", "Total (USD)": 999.00, "Image": "https://i.ebayimg.com/images/g/test/s-l500.jpg", "URL": "#"},
+        {"Source": "eBay", "Title": "Apple iPhone 15 Pro (Open Box)", "Condition": "Open Box", "Price Info": "850.00 USD (+ 15 ship)", "Total (USD)": 865.00, "Image": "https://i.ebayimg.com/images/g/test2/s-l500.jpg", "URL": "#"},
+        {"Source": "eBay", "Title": "iPhone 15 Pro Parts Only", "Condition": "Parts", "Price Info": "200.00 USD (+ 10 ship)", "Total (USD)": 210.00, "Image": "https://i.ebayimg.com/images/g/test3/s-l500.jpg", "URL": "#"},
+    ])
+
+    if condition_filter == "New":
+        return mock_db[mock_db['Condition'].str.contains("New")]
+    elif condition_filter == "Used/Refurbished":
+        return mock_db[~mock_db['Condition'].str.contains("New")]
+    return mock_db
+
+
+@st.cache_resource
+def get_aggregator(keys_tuple):
+    """Один агрегатор на набор ключей: не пересоздаём его на каждый клик"""
+    return EbayAggregator(dict(keys_tuple))
+
 
 # --- ИНТЕРФЕЙС (UI) ---
 
+@st.fragment
+def render_results():
+    """Отрисовка результатов из session_state.
+
+    Фрагмент перерисовывается отдельно от остального скрипта, поэтому
+    правки в таблице не перезапускают поиск.
+    """
+    df = st.session_state.get('results')
+    if df is None:
+        return
+
+    if not df.empty:
+        # Метрики: для лучшей цены достаточно min, полная сортировка
+        # нужна только таблице ниже
+        c1, c2 = st.columns(2)
+        c1.metric("Лучшая цена", f"${df['Total (USD)'].min():.2f}")
+        c2.metric("Найдено", len(df))
+
+        st.data_editor(
+            df.sort_values("Total (USD)", kind="mergesort"),
+            column_config={
+                "Image": st.column_config.ImageColumn("Фото", width="small"),
+                "URL": st.column_config.LinkColumn("Ссылка", display_text="Купить"),
+                "Total (USD)": st.column_config.NumberColumn("Итого", format="$%.2f"),
+                "Price Info": st.column_config.TextColumn("Цена + Доставка"),
+            },
+            hide_index=True,
+            use_container_width=True,
+            height=600
+        )
+    else:
+        st.info("Ничего не найдено. Проверьте ключи или измените запрос.")
+
+
+def _warm_caches(api_keys):
+    """Прогрев токена и курсов в фоне, пока пользователь набирает запрос"""
+    try:
+        _get_ebay_token_cached(api_keys['ebay_client_id'], api_keys['ebay_client_secret'])
+        _get_exchange_rates_cached(api_keys.get('exchange_rate_key', ''))
+    except Exception:
+        pass
+
+
 def main():
     st.title("🛒 eBay Smart Search")
     st.caption("Быстрый поиск товаров с фильтрацией состояния и конвертацией цен")
@@ -163,61 +504,72 @@ def main():
         st.divider()
         
         use_mock = st.checkbox("Демо-режим", value=True)
-        
+
+        if st.button("Очистить кеш"):
+            st.cache_data.clear()
+            _DISK_CACHE.clear()
+
         with st.expander("API Ключи (eBay)"):
             ebay_id = st.text_input("Client ID", type="password")
             ebay_secret = st.text_input("Client Secret", type="password")
             ex_rate_key = st.text_input("ExchangeRate API (Optional)", type="password")
 
+    api_keys = {
+        'ebay_client_id': ebay_id,
+        'ebay_client_secret': ebay_secret,
+        'exchange_rate_key': ex_rate_key
+    }
+
+    # Оба запроса первого поиска (токен + курсы) греем заранее в фоне,
+    # чтобы к моменту клика "Найти" они уже лежали в кеше
+    if not use_mock and ebay_id and ebay_secret and not st.session_state.get('warmed'):
+        st.session_state['warmed'] = True
+        threading.Thread(target=_warm_caches, args=(api_keys,), daemon=True).start()
+
     query = st.text_input("Поиск товара:", placeholder="Например: Sony PlayStation 5 Slim")
-    
-    if st.button("Найти", type="primary"):
+
+    search_clicked = st.button("Найти", type="primary")
+
+    # Дебаунс: случайный двойной клик в течение 300 мс не запускает
+    # второй веер запросов
+    now = time.monotonic()
+    if search_clicked:
+        if now - st.session_state.get('last_search_ts', 0.0) < 0.3:
+            search_clicked = False
+        else:
+            st.session_state['last_search_ts'] = now
+
+    if search_clicked:
         if not query:
             st.warning("Введите запрос!")
             return
 
-        api_keys = {
-            'ebay_client_id': ebay_id,
-            'ebay_client_secret': ebay_secret,
-            'exchange_rate_key': ex_rate_key
-        }
-
-        app = EbayAggregator(api_keys)
+        app = get_aggregator(tuple(sorted(api_keys.items())))
 
         with st.spinner('Поиск на eBay...'):
             if use_mock:
-                # Имитация
-                import time
-                time.sleep(0.5)
-                results = app.get_mock_data(condition)
+                df = get_mock_data(condition)
             else:
-                results = app.search_ebay(query, condition)
-
-        if results:
-            df = pd.DataFrame(results)
-            df = df.sort_values(by="Total (USD)")
-
-            # Метрики
-            if not df.empty:
-                best = df.iloc[0]
-                c1, c2 = st.columns(2)
-                c1.metric("Лучшая цена", f"${best['Total (USD)']:.2f}")
-                c2.metric("Найдено", len(df))
-
-                st.data_editor(
-                    df,
-                    column_config={
-                        "Image": st.column_config.ImageColumn("Фото", width="small"),
-                        "URL": st.column_config.LinkColumn("Ссылка", display_text="Купить"),
-                        "Total (USD)": st.column_config.NumberColumn("Итого", format="$%.2f"),
-                        "Price Info": st.column_config.TextColumn("Цена + Доставка"),
-                    },
-                    hide_index=True,
-                    use_container_width=True,
-                    height=600
-                )
-        else:
-            st.info("Ничего не найдено. Проверьте ключи или измените запрос.")
+                # Провайдер сейчас один; изолируем его сбой, чтобы падение
+                # поиска не роняло весь скрипт (и чтобы второй источник,
+                # когда появится, можно было просто добавить рядом)
+                try:
+                    # Широкий фильтр "Any" смешивает состояния - берём больше позиций
+                    limit = 20 if condition == "Any" else 10
+                    df = app.search_ebay(query, condition, limit=limit)
+                except Exception as e:
+                    import pandas as pd
+                    st.error(f"Поиск eBay не удался: {e}")
+                    df = pd.DataFrame(columns=_RESULT_COLUMNS)
+
+        if not df.empty:
+            # Явный dtype вместо object-инференса по колонке цен
+            df = df.astype({"Total (USD)": "float64"})
+
+        # Поиск выполняется только по клику; отрисовка читает session_state
+        st.session_state['results'] = df
+
+    render_results()
 
 if __name__ == "__main__":
     main()